@@ -1,7 +1,8 @@
 import hashlib
 import os
+from functools import lru_cache
 from io import BytesIO, StringIO
-from typing import Iterable, Optional, Dict
+from typing import Iterable, Optional, Dict, List
 from zipfile import ZipFile
 from tqdm import tqdm
 import shutil
@@ -26,6 +27,34 @@ class InputDirectory:
         self.directoryPath = path
         self.isLink = "://" in path
 
+    @property
+    def mtime(self) -> Optional[float]:
+        """
+        The latest modification time of the local raw output files this directory reads
+        from, including those of the run directories nested in it, or None for links and
+        when none of the files exist. Rewriting a file in place changes it, while
+        unrelated files added to the folder don't.
+
+        This is best effort: it covers the whole directory rather than the files one
+        frame reads, and misses files that are only found by listing a folder.
+        """
+        if self.isLink:
+            return None
+        mtimes = []
+        for value in vars(self).values():
+            nested = value.values() if isinstance(value, dict) else [value]
+            for item in nested:
+                if isinstance(item, RawOutputFile):
+                    try:
+                        mtimes.append(os.stat(item.filePath).st_mtime)
+                    except OSError:
+                        pass
+                elif isinstance(item, InputDirectory):
+                    mtime = item.mtime
+                    if mtime is not None:
+                        mtimes.append(mtime)
+        return max(mtimes, default=None)
+
     def append(self, relativePath):
         """
         Appends a relative path to the directory path and returns the combined path.
@@ -56,6 +85,7 @@ class RawOutputFile:
         filePath (str): The path to the output file.
         index_col: Optional parameter for specifying the column to use as the row labels.
         dtype: Optional parameter for specifying column data types.
+        engine: Optional parser engine passed to pd.read_csv, e.g. "pyarrow".
         _file: Internal variable to store the loaded file.
     """
 
@@ -66,11 +96,13 @@ class RawOutputFile:
         index_col=None,
         dtype=None,
         file=None,
+        engine=None,
     ):
         self.filePath = inputDirectory.append(relativePath)
         self.inputDirectory = inputDirectory
         self.index_col = index_col
         self.dtype = dtype
+        self.engine = engine
         self._file = file
 
     def file(self):
@@ -84,13 +116,47 @@ class RawOutputFile:
             print("Reading file from {0}".format(self.filePath))
             try:
                 self._file = pd.read_csv(
-                    self.filePath, index_col=self.index_col, dtype=None
+                    self.filePath,
+                    index_col=self.index_col,
+                    dtype=None,
+                    engine=self.engine,
                 )
             except FileNotFoundError:
                 print("File at {0} does not exist".format(self.filePath))
                 return None
         return self._file
 
+    def read(self, columns: List[str]) -> Optional[pd.DataFrame]:
+        """
+        Reads only some columns of the file. If the whole file is already in memory they
+        are taken from it; otherwise only those columns are parsed, and not kept.
+
+        Parameters:
+            columns (list): The columns to read, not counting the index.
+
+        Returns:
+            pd.DataFrame: The requested columns.
+        """
+        if self._file is not None:
+            return self._file.loc[:, columns]
+        if self.index_col is None:
+            index = []
+        elif isinstance(self.index_col, str):
+            index = [self.index_col]
+        else:
+            index = list(self.index_col)
+        print("Reading {0} columns from {1}".format(len(columns), self.filePath))
+        try:
+            return pd.read_csv(
+                self.filePath,
+                index_col=self.index_col,
+                usecols=index + list(columns),
+                engine=self.engine,
+            )
+        except FileNotFoundError:
+            print("File at {0} does not exist".format(self.filePath))
+            return None
+
     def isDefined(self):
         """
         Checks if the file is defined (loaded).
@@ -133,6 +199,11 @@ class Geometry:
                 self._gdf = pd.merge(
                     self._gdf, otherFile, left_on=self.index, right_on=key
                 )
+        # Zone attributes repeat across thousands of rows once merged onto other
+        # frames, so store them as categoricals to make grouping on them cheap
+        for col in ["county", "areatype10"]:
+            if col in self._gdf.columns:
+                self._gdf[col] = self._gdf[col].astype("category")
 
     def zoneToCountyMap(self):
         return NotImplementedError("This region is not defined yet")
@@ -176,6 +247,31 @@ class AustinGeometry(Geometry):
         raise NotImplementedError("No regions defined for Austin")
 
 
+@lru_cache(maxsize=4)
+def getGeometry(region: Optional[str]) -> Geometry:
+    """
+    Returns the geometry for a region, loading it only once per process.
+
+    Geometries are read-only lookup tables, so a single instance is shared by every
+    run directory and output data object in the same region.
+
+    Parameters:
+        region (str): "SFBay" or "Austin". Anything else gives an empty Geometry.
+
+    Returns:
+        Geometry: The shared geometry instance.
+    """
+    if region == "SFBay":
+        return SfBayGeometry(
+            otherFiles={
+                "geoms/Plan_Bay_Area_2040_Forecast__Land_Use_and_Transportation.csv": "zoneid"
+            }
+        )
+    elif region == "Austin":
+        return AustinGeometry(otherFiles=dict())
+    return Geometry()
+
+
 class EventsFile(RawOutputFile):
     """
     Represents an events file produced by BEAM
@@ -193,7 +289,7 @@ class EventsFile(RawOutputFile):
             iteration (int): The BEAM iteration number to use.
         """
         dtypes = {
-            "type": str,
+            "type": "category",
             "numPassengers": "Int64",
             "driver": "str",
             "riders": "str",
@@ -224,6 +320,7 @@ class EventsFile(RawOutputFile):
             self.filePath,
             chunksize=self.__chunksize,
             dtype={
+                "type": "category",
                 "driver": "str",
                 "riders": "str",
                 "linkTravelTime": "str",
@@ -233,14 +330,20 @@ class EventsFile(RawOutputFile):
                 "parkingTaz": "str",
             },
         ):
+            # Categories are inferred per chunk, so they list exactly the types present
+            presentTypes = chunk["type"].cat.categories
             for eventType in eventTypes:
-                __listOfFrames[eventType].append(
-                    chunk.loc[chunk["type"] == eventType, :].dropna(axis=1, how="all")
-                )
+                if eventType in presentTypes:
+                    __listOfFrames[eventType].append(
+                        chunk.loc[chunk["type"] == eventType, :].dropna(
+                            axis=1, how="all"
+                        )
+                    )
         for eventType in eventTypes:
             print("Extracting {0} events from raw events file".format(eventType))
-            self.eventTypes[eventType] = pd.concat(
-                __listOfFrames.pop(eventType), axis=0
+            frames = __listOfFrames.pop(eventType)
+            self.eventTypes[eventType] = (
+                pd.concat(frames, axis=0) if frames else pd.DataFrame()
             )
 
 
@@ -338,16 +441,7 @@ class BeamRunInputDirectory(InputDirectory):
         self.inputPlansFile = InputPlansFile(self)
         self.linkStatsFile = LinkStatsFile(self, numberOfIterations)
         if (region is not None) & (geometry is None):
-            if region == "SFBay":
-                self.geometry = SfBayGeometry(
-                    otherFiles={
-                        "geoms/Plan_Bay_Area_2040_Forecast__Land_Use_and_Transportation.csv": "zoneid"
-                    }
-                )
-            elif region == "Austin":
-                self.geometry = AustinGeometry(otherFiles=dict())
-            else:
-                self.geometry = Geometry()
+            self.geometry = getGeometry(region)
         else:
             self.geometry = geometry
         self.networkFile = NetworkFile(self, self.geometry)
@@ -437,7 +531,9 @@ class TripUtilitiesFiles(RawOutputFile):
 class PersonsFile(RawOutputFile):
     def __init__(self, inputDirectory: InputDirectory):
         relativePath = "persons.csv.gz"
-        super().__init__(inputDirectory, relativePath, index_col="person_id")
+        super().__init__(
+            inputDirectory, relativePath, index_col="person_id", engine="pyarrow"
+        )
 
     def split(self, person_id_to_division) -> (Dict[str, pd.DataFrame], Dict[int, str]):
         households = self.file()["household_id"].reset_index()
@@ -453,7 +549,9 @@ class PersonsFile(RawOutputFile):
 class HouseholdsFile(RawOutputFile):
     def __init__(self, inputDirectory: InputDirectory):
         relativePath = "households.csv.gz"
-        super().__init__(inputDirectory, relativePath, index_col="household_id")
+        super().__init__(
+            inputDirectory, relativePath, index_col="household_id", engine="pyarrow"
+        )
 
     def split(
         self, household_id_to_division
@@ -471,6 +569,7 @@ class TripsFile(RawOutputFile):
             relativePath,
             index_col="trip_id",
             dtype={"household_id": int, "person_id": int, "tour_id": int},
+            engine="pyarrow",
         )
 
     def split(self, trip_id_to_division) -> (Dict[str, pd.DataFrame], Dict[int, str]):
@@ -530,9 +629,50 @@ class ToursFile(RawOutputFile):
             relativePath,
             index_col="tour_id",
             dtype={"household_id": int, "person_id": int, "trip_id": int},
+            engine="pyarrow",
         )
 
 
+@lru_cache(maxsize=None)
+def loadSkims(url: str) -> pd.DataFrame:
+    """
+    Downloads and parses a skims file, once per URL for the whole process.
+
+    Parameters:
+        url (str): The location of the skims.omx file.
+
+    Returns:
+        pd.DataFrame: Distance and transit time skims indexed by origin and destination.
+    """
+    # TODO: Support local files too
+    loc = os.path.join(
+        ".tmp", "skims-{0}.omx".format(hashlib.md5(url.encode()).hexdigest())
+    )
+    if not os.path.exists(loc):
+        os.makedirs(".tmp", exist_ok=True)
+        urllib.request.urlretrieve(url, loc)
+    sk = omx.open_file(loc, "r")
+    distMat = np.array(sk["SOV_DIST__AM"])
+    transitTimeMat = np.array(sk["WLK_TRN_WLK_IVT__AM"])
+    sk.close()
+    zones = np.arange(1, distMat.shape[0] + 1)
+    distDf = (
+        pd.DataFrame(
+            distMat,
+            index=pd.Index(zones, name="Origin"),
+            columns=pd.Index(zones, name="Destination"),
+        )
+        .stack()
+        .rename("DistanceMiles")
+    ).to_frame()
+    distDf["transitTravelTimeHours"] = pd.DataFrame(
+        transitTimeMat / 100.0 / 60.0,
+        index=pd.Index(zones, name="Origin"),
+        columns=pd.Index(zones, name="Destination"),
+    ).stack()
+    return distDf
+
+
 class SkimsFile(RawOutputFile):
     """
     Represents a skims file used in activity-based models.
@@ -549,30 +689,8 @@ class SkimsFile(RawOutputFile):
             inputDirectory (InputDirectory): The output directory where the file is stored.
         """
         relativePath = ["activitysim", "data", "data", "skims.omx"]
-        # TODO: Support local files too
-        loc = ".tmp/skims.omx"
-        if not os.path.exists(loc):
-            url = inputDirectory.append(relativePath)
-            urllib.request.urlretrieve(url, ".tmp/skims.omx")
-        sk = omx.open_file(loc, "r")
-        distMat = np.array(sk["SOV_DIST__AM"])
-        transitTimeMat = np.array(sk["WLK_TRN_WLK_IVT__AM"])
-        distDf = (
-            pd.DataFrame(
-                distMat,
-                index=pd.Index(np.arange(1, distMat.shape[0]+1), name="Origin"),
-                columns=pd.Index(np.arange(1, distMat.shape[0]+1), name="Destination"),
-            )
-            .stack()
-            .rename("DistanceMiles")
-        ).to_frame()
-        distDf["transitTravelTimeHours"] = pd.DataFrame(
-            transitTimeMat / 100.0 / 60.0,
-            index=pd.Index(np.arange(1, distMat.shape[0]+1), name="Origin"),
-            columns=pd.Index(np.arange(1, distMat.shape[0]+1), name="Destination"),
-        ).stack()
-        super().__init__(inputDirectory, loc, file=distDf)
-        sk.close()
+        url = inputDirectory.append(relativePath)
+        super().__init__(inputDirectory, relativePath, file=loadSkims(url))
 
 
 class ActivitySimRunInputDirectory(InputDirectory):
@@ -619,16 +737,7 @@ class PilatesRunInputDirectory(InputDirectory):
         self.asimRuns = dict()
         self.beamRuns = dict()
         self.skims = SkimsFile(self)
-        if region == "SFBay":
-            self.geometry = SfBayGeometry(
-                otherFiles={
-                    "geoms/Plan_Bay_Area_2040_Forecast__Land_Use_and_Transportation.csv": "zoneid"
-                }
-            )
-        elif region == "Austin":
-            self.geometry = AustinGeometry(otherFiles=dict())
-        else:
-            self.geometry = Geometry()
+        self.geometry = getGeometry(region)
         for year in years:
             for asimLiteIteration in [-1, *np.arange(asimLiteIterations) + 1]:
                 relPath = [
@@ -1,7 +1,12 @@
-import urllib.request
+import gc
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 from multiprocessing import cpu_count
 from typing import Tuple, Dict, Iterable, Optional
 from urllib.error import HTTPError
+from urllib.parse import urlparse
 import pandas as pd
 
 import urllib3
@@ -11,9 +16,8 @@ from src.input import (
     BeamRunInputDirectory,
     ActivitySimRunInputDirectory,
     PilatesRunInputDirectory,
-    SfBayGeometry,
     Geometry,
-    AustinGeometry,
+    getGeometry,
 )
 from src.outputDataFrame import (
     PathTraversalEvents,
@@ -46,7 +50,94 @@ from src.outputDataFrame import (
     PersonTrips,
     CongestionInfoByYear,
 )
-from src.transformations import assignTripIdToEvents, mergeWithTripsAndAggregate
+from src.transformations import combineChunk
+
+_connectionPool = urllib3.PoolManager(maxsize=32)
+
+
+def _pathExists(path: str) -> bool:
+    """
+    Checks whether a file exists. Remote files are checked with a HEAD request that
+    reuses pooled keep-alive connections, local files directly on disk.
+
+    Parameters:
+        path (str): The URL or local path of the file.
+
+    Returns:
+        bool: True if the file can be found, False otherwise.
+    """
+    parsed = urlparse(path)
+    if parsed.scheme in ("", "file"):
+        return os.path.exists(parsed.path)
+    try:
+        response = _connectionPool.request("HEAD", path, retries=False)
+    except urllib3.exceptions.HTTPError:
+        return False
+    return response.status < 400
+
+
+def _availableMemory() -> Optional[int]:
+    """
+    Returns the number of bytes of physical memory currently available, if known.
+    """
+    # On Linux MemAvailable also counts page cache that can be reclaimed, which fills
+    # up after streaming the events files; free pages alone would undercount memory
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+def _workerCount(sampleTask: Tuple, memoryFraction: float = 0.6) -> int:
+    """
+    Chooses how many parallel workers to run so that their inputs fit in memory.
+
+    Parameters:
+        sampleTask (tuple): The arguments of one representative task.
+        memoryFraction (float): Share of the available memory the workers may use.
+
+    Returns:
+        int: The number of workers, between 1 and the number of CPUs.
+    """
+    available = _availableMemory()
+    if available is None:
+        return max(1, cpu_count() // 2)
+    taskBytes = sum(
+        arg.memory_usage(deep=True).sum()
+        for arg in sampleTask
+        if isinstance(arg, pd.DataFrame)
+    )
+    # Merging and aggregating a chunk needs a few times the size of its inputs
+    perWorker = max(int(taskBytes) * 6, 1)
+    return max(1, min(cpu_count(), int(available * memoryFraction / perWorker)))
+
+
+def validateDirectories(directories: Dict, probeFile: str) -> Dict:
+    """
+    Concurrently checks which input directories contain a given file.
+
+    Parameters:
+        directories (dict): Input directories keyed by e.g. (year, iteration).
+        probeFile (str): Relative path of a file that every complete run contains.
+
+    Returns:
+        dict: The subset of directories in which the probe file exists.
+    """
+    keys = list(directories.keys())
+    with ThreadPoolExecutor(max_workers=32) as executor:
+        exists = list(
+            executor.map(
+                _pathExists, [directories[key].append(probeFile) for key in keys]
+            )
+        )
+    return {key: directories[key] for key, found in zip(keys, exists) if found}
 
 
 class OutputDataDirectory:
@@ -75,11 +166,14 @@ class BeamOutputData:
         linkStatsFromPathTraversals (src.outputDataFrame.LinkStatsFromPathTraversals): Alternative linkstats
     """
 
+    probeFile = "beamLog.out"
+
     def __init__(
         self,
         outputDataDirectory: OutputDataDirectory,
         beamRunInputDirectory: BeamRunInputDirectory,
         collectEvents=False,
+        forceRefresh=False,
     ):
         """
         Initializes a BeamOutputData instance.
@@ -87,55 +181,92 @@ class BeamOutputData:
         Parameters:
             outputDataDirectory (OutputDataDirectory): The output data directory.
             beamRunInputDirectory (BeamRunInputDirectory): The input directory for the Beam run.
+            forceRefresh (bool): Recompute the labeled link stats and TAZ traffic volumes
+                instead of reading them from the parquet cache.
         """
         self.outputDataDirectory = outputDataDirectory
         self.beamRunInputDirectory = beamRunInputDirectory
-        self.logFileRequest = urllib.request.Request(
-            beamRunInputDirectory.append("beamLog.out")
-        )
-        self.logFileRequest.get_method = lambda: "HEAD"
-        self.logFile = urllib.request.urlopen(self.logFileRequest)
         self.geometry = beamRunInputDirectory.geometry
+        self.forceRefresh = forceRefresh
 
         if collectEvents:
             self.beamRunInputDirectory.eventsFile.collectEvents(
                 ["PathTraversal", "PersonEntersVehicle", "ModeChoice"]
             )
 
-        self.pathTraversalEvents = PathTraversalEvents(
-            self.outputDataDirectory, self.beamRunInputDirectory
-        )
-        self.personEntersVehicleEvents = PersonEntersVehicleEvents(
-            self.outputDataDirectory, self.beamRunInputDirectory
-        )
-        self.modeChoiceEvents = ModeChoiceEvents(
-            self.outputDataDirectory, self.beamRunInputDirectory
-        )
+    # The output dataframes are only constructed the first time they are
+    # accessed, so callers that read a single product don't pay for the rest
 
-        self.personTrips = PersonTrips(
+    @cached_property
+    def pathTraversalEvents(self) -> PathTraversalEvents:
+        return PathTraversalEvents(self.outputDataDirectory, self.beamRunInputDirectory)
+
+    @cached_property
+    def personEntersVehicleEvents(self) -> PersonEntersVehicleEvents:
+        return PersonEntersVehicleEvents(
             self.outputDataDirectory, self.beamRunInputDirectory
         )
 
-        self.modeVMT = ModeVMT(self.outputDataDirectory, self.pathTraversalEvents)
-        self.modeEnergy = ModeEnergy(self.outputDataDirectory, self.pathTraversalEvents)
-        self.linkStatsFromPathTraversals = LinkStatsFromPathTraversals(
+    @cached_property
+    def modeChoiceEvents(self) -> ModeChoiceEvents:
+        return ModeChoiceEvents(self.outputDataDirectory, self.beamRunInputDirectory)
+
+    @cached_property
+    def personTrips(self) -> PersonTrips:
+        return PersonTrips(self.outputDataDirectory, self.beamRunInputDirectory)
+
+    @cached_property
+    def modeVMT(self) -> ModeVMT:
+        return ModeVMT(self.outputDataDirectory, self.pathTraversalEvents)
+
+    @cached_property
+    def modeEnergy(self) -> ModeEnergy:
+        return ModeEnergy(self.outputDataDirectory, self.pathTraversalEvents)
+
+    @cached_property
+    def linkStatsFromPathTraversals(self) -> LinkStatsFromPathTraversals:
+        return LinkStatsFromPathTraversals(
             self.outputDataDirectory, self.pathTraversalEvents
         )
-        self.labeledNetwork = LabeledNetwork(
-            self.outputDataDirectory, self.beamRunInputDirectory
-        )
-        self.labeledLinkStatsFile = LabeledLinkStatsFile(
+
+    @cached_property
+    def labeledNetwork(self) -> LabeledNetwork:
+        return LabeledNetwork(self.outputDataDirectory, self.beamRunInputDirectory)
+
+    @cached_property
+    def labeledLinkStatsFile(self) -> LabeledLinkStatsFile:
+        labeledLinkStatsFile = LabeledLinkStatsFile(
             self.outputDataDirectory,
             self.beamRunInputDirectory.linkStatsFile,
             self.labeledNetwork,
             self.geometry,
         )
-        self.tazTrafficVolumes = TAZTrafficVolumes(
+        if self.forceRefresh:
+            labeledLinkStatsFile.clearCache()
+        return labeledLinkStatsFile
+
+    @cached_property
+    def tazTrafficVolumes(self) -> TAZTrafficVolumes:
+        tazTrafficVolumes = TAZTrafficVolumes(
             self.outputDataDirectory, self.labeledLinkStatsFile, self.geometry
         )
+        if self.forceRefresh:
+            tazTrafficVolumes.clearCache()
+        return tazTrafficVolumes
+
+    @classmethod
+    def validateMany(
+        cls, directories: Dict[Tuple[int, int], BeamRunInputDirectory]
+    ) -> Dict[Tuple[int, int], BeamRunInputDirectory]:
+        """
+        Returns the BEAM run directories that contain a beamLog.out file.
+        """
+        return validateDirectories(directories, cls.probeFile)
 
 
 class ActivitySimOutputData:
+    probeFile = "final_land_use.csv.gz"
+
     def __init__(
         self,
         outputDataDirectory: OutputDataDirectory,
@@ -147,43 +278,65 @@ class ActivitySimOutputData:
         self.activitySimRunInputDirectory = activitySimRunInputDirectory
         self.skims = skims
         self.geometry = geometry
-        self.logFileRequest = urllib.request.Request(
-            activitySimRunInputDirectory.append("final_land_use.csv.gz")
-        )
-        self.logFileRequest.get_method = lambda: "HEAD"
-        self.logFile = urllib.request.urlopen(self.logFileRequest)
 
-        self.persons = ProcessedPersonsFile(
+    @cached_property
+    def persons(self) -> ProcessedPersonsFile:
+        return ProcessedPersonsFile(
             self.outputDataDirectory, self.activitySimRunInputDirectory
         )
 
-        self.households = ProcessedHouseholdsFile(
+    @cached_property
+    def households(self) -> ProcessedHouseholdsFile:
+        return ProcessedHouseholdsFile(
             self.outputDataDirectory, self.activitySimRunInputDirectory
         )
 
-        self.trips = ProcessedTripsFile(
+    @cached_property
+    def trips(self) -> ProcessedTripsFile:
+        return ProcessedTripsFile(
             self.outputDataDirectory, self.activitySimRunInputDirectory
         )
 
-        self.mandatoryLocationsByTaz = MandatoryLocationsByTaz(
+    @cached_property
+    def mandatoryLocationsByTaz(self) -> MandatoryLocationsByTaz:
+        return MandatoryLocationsByTaz(
             self.outputDataDirectory, self.persons, self.geometry
         )
-        self.tripPMT = TripPMT(self.outputDataDirectory, self.trips, self.skims)
-        self.tripPMTByOrigin = TripPMTByOrigin(
-            self.outputDataDirectory, self.trips, self.skims
-        )
-        self.tripPMTByPrimaryPurpose = TripPMTByPrimaryPurpose(
-            self.outputDataDirectory, self.trips, self.skims
-        )
-        self.tripModeCount = TripModeCount(
-            self.outputDataDirectory, self.trips, self.geometry
-        )
-        self.tripModeCountByOrigin = TripModeCountByOrigin(
+
+    @cached_property
+    def tripPMT(self) -> TripPMT:
+        return TripPMT(self.outputDataDirectory, self.trips, self.skims)
+
+    @cached_property
+    def tripPMTByOrigin(self) -> TripPMTByOrigin:
+        return TripPMTByOrigin(self.outputDataDirectory, self.trips, self.skims)
+
+    @cached_property
+    def tripPMTByPrimaryPurpose(self) -> TripPMTByPrimaryPurpose:
+        return TripPMTByPrimaryPurpose(self.outputDataDirectory, self.trips, self.skims)
+
+    @cached_property
+    def tripModeCount(self) -> TripModeCount:
+        return TripModeCount(self.outputDataDirectory, self.trips, self.geometry)
+
+    @cached_property
+    def tripModeCountByOrigin(self) -> TripModeCountByOrigin:
+        return TripModeCountByOrigin(
             self.outputDataDirectory, self.trips, self.geometry
         )
-        self.tripModeCountByPrimaryPurpose = TripModeCountByPrimaryPurpose(
-            self.outputDataDirectory, self.trips
-        )
+
+    @cached_property
+    def tripModeCountByPrimaryPurpose(self) -> TripModeCountByPrimaryPurpose:
+        return TripModeCountByPrimaryPurpose(self.outputDataDirectory, self.trips)
+
+    @classmethod
+    def validateMany(
+        cls, directories: Dict[Tuple[int, int], ActivitySimRunInputDirectory]
+    ) -> Dict[Tuple[int, int], ActivitySimRunInputDirectory]:
+        """
+        Returns the ActivitySim run directories that contain a final_land_use.csv.gz file.
+        """
+        return validateDirectories(directories, cls.probeFile)
 
 
 class PilatesOutputData:
@@ -195,64 +348,86 @@ class PilatesOutputData:
     ):
         self.outputDataDirectory = outputDataDirectory
         self.pilatesRunInputDirectory = pilatesRunInputDirectory
-        self.asimRuns = dict[Tuple[int, int], ActivitySimOutputData]()
-        self.beamRuns = dict[Tuple[int, int], BeamOutputData]()
-        self.skims = ProcessedSkimsFile(
-            self.outputDataDirectory, self.pilatesRunInputDirectory
-        )
-        if region == "SFBay":
-            self.geometry = SfBayGeometry(
-                otherFiles={
-                    "geoms/Plan_Bay_Area_2040_Forecast__Land_Use_and_Transportation.csv": "zoneid"
-                }
+        self.asimRuns: Dict[Tuple[int, int], ActivitySimOutputData] = {}
+        self.beamRuns: Dict[Tuple[int, int], BeamOutputData] = {}
+        # Probe the ASim and BEAM run directories in the background while the
+        # skims and geometry are loaded
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            asimProbes = executor.submit(
+                ActivitySimOutputData.validateMany, pilatesRunInputDirectory.asimRuns
             )
-        elif region == "Austin":
-            self.geometry = AustinGeometry(otherFiles=dict())
-        else:
-            self.geometry = Geometry()
+            beamProbes = executor.submit(
+                BeamOutputData.validateMany, pilatesRunInputDirectory.beamRuns
+            )
+            self.skims = ProcessedSkimsFile(
+                self.outputDataDirectory, self.pilatesRunInputDirectory
+            )
+            self.geometry = getGeometry(region)
+            validAsimRuns = asimProbes.result()
+            validBeamRuns = beamProbes.result()
 
         for (yr, it), directory in pilatesRunInputDirectory.asimRuns.items():
-            try:
+            if (yr, it) in validAsimRuns:
                 self.asimRuns[(yr, it)] = ActivitySimOutputData(
                     outputDataDirectory, directory, self.skims, self.geometry
                 )
-            except HTTPError:
+            else:
                 print("Skipping ASim year {0} iteration {1}".format(yr, it))
 
         for (yr, it), directory in pilatesRunInputDirectory.beamRuns.items():
-            try:
-                self.beamRuns[(yr, it)] = BeamOutputData(
-                    outputDataDirectory, directory
-                )
-            except HTTPError:
+            if (yr, it) in validBeamRuns:
+                self.beamRuns[(yr, it)] = BeamOutputData(outputDataDirectory, directory)
+            else:
                 print("Skipping BEAM year {0} iteration {1}".format(yr, it))
 
-        self.mandatoryLocationsByTazByYear = MandatoryLocationByTazByYear(
+    @cached_property
+    def mandatoryLocationsByTazByYear(self) -> MandatoryLocationByTazByYear:
+        return MandatoryLocationByTazByYear(
             self.outputDataDirectory,
             self.pilatesRunInputDirectory,
             self.asimRuns,
             self.geometry,
         )
 
-        self.tripPMTPerYear = TripPMTByYear(
+    @cached_property
+    def tripPMTPerYear(self) -> TripPMTByYear:
+        return TripPMTByYear(
             self.outputDataDirectory, self.pilatesRunInputDirectory, self.asimRuns
         )
-        self.tripPMTByCountyPerYear = TripPMTByCountyByYear(
+
+    @cached_property
+    def tripPMTByCountyPerYear(self) -> TripPMTByCountyByYear:
+        return TripPMTByCountyByYear(
             self.outputDataDirectory, self.pilatesRunInputDirectory, self.asimRuns
         )
-        self.tripModeCountPerYear = TripModeCountByYear(
+
+    @cached_property
+    def tripModeCountPerYear(self) -> TripModeCountByYear:
+        return TripModeCountByYear(
             self.outputDataDirectory, self.pilatesRunInputDirectory, self.asimRuns
         )
-        self.tripModeCountByCountyPerYear = TripModeCountByCountyByYear(
+
+    @cached_property
+    def tripModeCountByCountyPerYear(self) -> TripModeCountByCountyByYear:
+        return TripModeCountByCountyByYear(
             self.outputDataDirectory, self.pilatesRunInputDirectory, self.asimRuns
         )
-        self.modeVMTPerYear = ModeVMTByYear(
+
+    @cached_property
+    def modeVMTPerYear(self) -> ModeVMTByYear:
+        return ModeVMTByYear(
             self.outputDataDirectory, self.pilatesRunInputDirectory, self.beamRuns
         )
-        self.modeEnergyPerYear = ModeEnergyByYear(
+
+    @cached_property
+    def modeEnergyPerYear(self) -> ModeEnergyByYear:
+        return ModeEnergyByYear(
             self.outputDataDirectory, self.pilatesRunInputDirectory, self.beamRuns
         )
-        self.congestionInfoByYear = CongestionInfoByYear(
+
+    @cached_property
+    def congestionInfoByYear(self) -> CongestionInfoByYear:
+        return CongestionInfoByYear(
             self.outputDataDirectory, self.pilatesRunInputDirectory, self.beamRuns
         )
 
@@ -275,43 +450,57 @@ class PilatesOutputData:
         pe = combinedData["ParkingEvent"]
         rp = combinedData["Replanning"]
 
-        def combineChunk(chunk):
-            pts = assignTripIdToEvents(
-                pt[chunk],
-                mc[chunk],
-                {
-                    "mode_choice_actual_BEAM": "mode_choice_actual_BEAM",
-                    "mode_choice_planned_BEAM": "mode_choice_planned_BEAM",
-                    "distance_mode_choice": "distance_mode_choice",
-                },
-            )
-            tes = assignTripIdToEvents(
-                te[chunk], mc[chunk], {"distance_mode_choice": "distance_travelling"}
-            )
-            tes["distance_privateCar"] = tes["distance_travelling"].copy()
-            tes["distance_mode_choice"] = tes["distance_travelling"].copy()
-            pcs = assignTripIdToEvents(pc[chunk], mc[chunk])
-            pes = assignTripIdToEvents(pe[chunk], mc[chunk])
-            rps = assignTripIdToEvents(rp[chunk], mc[chunk])
-            allEvents = pd.concat([pts, tes, pcs, pes, rps], axis=0)
-            combined = mergeWithTripsAndAggregate(
-                allEvents,
-                division_to_trips[chunk],
-                division_to_utilities[chunk],
-                division_to_persons[chunk],
+        # Slice each chunk's inputs up front so that only that chunk is sent to a
+        # worker. Event types that are missing from a chunk are passed as None
+        tasks = deque(
+            (
+                (
+                    pt.get(chunk),
+                    mc[chunk],
+                    te.get(chunk),
+                    pc.get(chunk),
+                    pe.get(chunk),
+                    rp.get(chunk),
+                    division_to_trips[chunk],
+                    division_to_utilities[chunk],
+                    division_to_persons[chunk],
+                )
+                for chunk in mc.keys()
             )
-            return combined
+        )
+        # From here on the tasks hold the only references to the chunked events and
+        # ActivitySim tables
+        del combinedData, mc, pt, te, pc, pe, rp
+        del division_to_utilities, division_to_trips, division_to_persons
+        del division_to_households, person_id_to_division
 
         test = False
         if test:
-            out = combineChunk(list(person_id_to_division.values())[0])
+            out = combineChunk(*tasks[0])
             print("Success!")
 
-        processed_list = Parallel(n_jobs=cpu_count() // 2)(
-            delayed(combineChunk)(ch) for ch in mc.keys()
-        )
-
-        combinedData = pd.concat(processed_list, axis=0)
+        nJobs = _workerCount(tasks[0])
+        print("Combining {0} chunks with {1} workers".format(len(tasks), nJobs))
+        # Tasks are popped as they are dispatched so that each chunk's inputs can
+        # be freed in this process while the remaining chunks are still running
+        processed_list = list(
+            Parallel(
+                n_jobs=nJobs,
+                max_nbytes="1M",
+                mmap_mode="r",
+                batch_size="auto",
+                pre_dispatch="2*n_jobs",
+                return_as="generator",
+            )(delayed(combineChunk)(*tasks.popleft()) for _ in range(len(tasks)))
+        )
+        gc.collect()
+
+        # Every chunk is aggregated with the same columns, so stack them as they
+        # come rather than aligning or sorting the columns
+        combinedData = pd.concat(
+            processed_list, axis=0, copy=False, ignore_index=True, sort=False
+        )
+        del processed_list
 
         print(
             "Finding {0} unmatched ASim trips and {1} unmatched BEAM trips out of {2} total".format(
@@ -343,28 +532,11 @@ class PilatesSettings:
 class PilatesAnalysis:
     def __init__(self, allPilatesSettings: Iterable[PilatesSettings]):
         self.allPilatesSettings = allPilatesSettings
+        self._settings = {ps.scenarioName: ps for ps in self.allPilatesSettings}
         self._runs = dict()
-        for ps in self.allPilatesSettings:
-            directory = PilatesRunInputDirectory(
-                ps.path, ps.years, ps.asimLiteIteratsions, ps.beamIterations
-            )
-            self._runs[ps.scenarioName] = PilatesOutputData(
-                OutputDataDirectory("output/{0}".format(ps.scenarioName)), directory
-            )
-        self._pops = dict()
-        self._popsByCounty = dict()
-        self._popsByRegionType = dict()
-        self._popsByCountyAndRegionType = dict()
-        self._modechoices = dict()
-        self._modeChoicesByCounty = dict()
-        self._pmtByCounty = dict()
-        self._modeChoiceByPurpose = dict()
-        self._pmtByPurpose = dict()
-        self._modeVMT = dict()
-        self._modeEnergy = dict()
         """      
         # Here's an example of how to group by county and road type
-        look = self._runs["base"].beamRuns[(2010, -1)].tazTrafficVolumes
+        look = self._getRun("base").beamRuns[(2010, -1)].tazTrafficVolumes
         look.process(
             dict(),
             ["county", "hour", "attributeOrigType"],
@@ -372,111 +544,128 @@ class PilatesAnalysis:
         )
         """
 
-    @property
+    def _getRun(self, scenarioName: str) -> PilatesOutputData:
+        """
+        Returns the output data for a scenario, constructing it on first use.
+        """
+        if scenarioName not in self._runs:
+            ps = self._settings[scenarioName]
+            directory = PilatesRunInputDirectory(
+                ps.path, ps.years, ps.asimLiteIteratsions, ps.beamIterations
+            )
+            self._runs[scenarioName] = PilatesOutputData(
+                OutputDataDirectory("output/{0}".format(ps.scenarioName)), directory
+            )
+        return self._runs[scenarioName]
+
+    def _iterRuns(self):
+        for scenarioName in self._settings.keys():
+            yield scenarioName, self._getRun(scenarioName)
+
+    @staticmethod
+    def _concatScenarios(frames: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+        """
+        Stacks per-scenario results into one DataFrame with a leading scenario level.
+        """
+        objs = list(frames.values())
+        if len(objs) == 0:
+            return pd.DataFrame()
+        return pd.concat(
+            objs,
+            keys=list(frames.keys()),
+            names=["scenario"] + list(objs[0].index.names),
+            sort=False,
+            copy=False,
+        )
+
+    @cached_property
     def populationByTaz(self):
-        if len(self._pops) == 0:
-            for scenarioName, data in self._runs.items():
-                self._pops[scenarioName] = data.mandatoryLocationsByTazByYear.process(
+        return self._concatScenarios(
+            {
+                scenarioName: data.mandatoryLocationsByTazByYear.process(
                     normalize={"population": "area", "jobs": "area"}
                 )
-        return pd.concat(
-            self._pops, names=["scenario"] + self._pops[scenarioName].index.names
+                for scenarioName, data in self._iterRuns()
+            }
         )
 
-    @property
+    @cached_property
     def populationByRegionType(self):
-        if len(self._popsByRegionType) == 0:
-            for scenarioName, data in self._runs.items():
-                self._popsByRegionType[
-                    scenarioName
-                ] = data.mandatoryLocationsByTazByYear.process(
+        return self._concatScenarios(
+            {
+                scenarioName: data.mandatoryLocationsByTazByYear.process(
                     normalize={"population": "area", "jobs": "area"},
                     aggregateBy=["areatype10", "year"],
                     mapping={"population": "sum", "jobs": "sum"},
                 )
-        return pd.concat(
-            self._popsByRegionType,
-            names=["scenario"] + self._popsByRegionType[scenarioName].index.names,
+                for scenarioName, data in self._iterRuns()
+            }
         )
 
-    @property
+    @cached_property
     def populationByCountyAndRegionType(self):
-        if len(self._popsByCountyAndRegionType) == 0:
-            for scenarioName, data in self._runs.items():
-                self._popsByCountyAndRegionType[
-                    scenarioName
-                ] = data.mandatoryLocationsByTazByYear.process(
+        return self._concatScenarios(
+            {
+                scenarioName: data.mandatoryLocationsByTazByYear.process(
                     normalize={"population": "area", "jobs": "area"},
                     aggregateBy=["county", "areatype10", "year"],
                     mapping={"population": "sum", "jobs": "sum"},
                 )
-        return pd.concat(
-            self._popsByCountyAndRegionType,
-            names=["scenario"]
-            + self._popsByCountyAndRegionType[scenarioName].index.names,
+                for scenarioName, data in self._iterRuns()
+            }
         )
 
-    @property
+    @cached_property
     def populationByCounty(self):
-        if len(self._popsByCounty) == 0:
-            for scenarioName, data in self._runs.items():
-                self._popsByCounty[
-                    scenarioName
-                ] = data.mandatoryLocationsByTazByYear.process(
+        return self._concatScenarios(
+            {
+                scenarioName: data.mandatoryLocationsByTazByYear.process(
                     normalize={"population": "area", "jobs": "area"},
                     aggregateBy=["county", "year"],
                     mapping={"population": "sum", "jobs": "sum"},
                 )
-        return pd.concat(
-            self._popsByCounty,
-            names=["scenario"] + self._popsByCounty[scenarioName].index.names,
+                for scenarioName, data in self._iterRuns()
+            }
         )
 
-    @property
+    @cached_property
     def tripModeCount(self):
-        if len(self._modechoices) == 0:
-            for scenarioName, data in self._runs.items():
-                self._modechoices[scenarioName] = data.tripModeCountPerYear.dataFrame
-        return pd.concat(
-            self._modechoices,
-            names=["scenario"] + data.tripModeCountPerYear.dataFrame.index.names,
+        return self._concatScenarios(
+            {
+                scenarioName: data.tripModeCountPerYear.dataFrame
+                for scenarioName, data in self._iterRuns()
+            }
         )
 
-    @property
+    @cached_property
     def tripModeCountByCounty(self):
-        if len(self._modeChoicesByCounty) == 0:
-            for scenarioName, data in self._runs.items():
-                self._modeChoicesByCounty[
-                    scenarioName
-                ] = data.tripModeCountByCountyPerYear.dataFrame
-        return pd.concat(
-            self._modeChoicesByCounty,
-            names=["scenario"]
-            + data.tripModeCountByCountyPerYear.dataFrame.index.names,
+        return self._concatScenarios(
+            {
+                scenarioName: data.tripModeCountByCountyPerYear.dataFrame
+                for scenarioName, data in self._iterRuns()
+            }
         )
 
-    @property
+    @cached_property
     def vmtByMode(self):
-        if len(self._modeVMT) == 0:
-            for scenarioName, data in self._runs.items():
-                try:
-                    self._modeVMT[scenarioName] = data.modeVMTPerYear.dataFrame
-                except HTTPError:
-                    continue
-        return pd.concat(
-            {key: val for key, val in self._modeVMT.items() if len(val) > 0},
-            names=["scenario"] + data.modeVMTPerYear.dataFrame.index.names,
+        modeVMT = dict()
+        for scenarioName, data in self._iterRuns():
+            try:
+                modeVMT[scenarioName] = data.modeVMTPerYear.dataFrame
+            except HTTPError:
+                continue
+        return self._concatScenarios(
+            {key: val for key, val in modeVMT.items() if len(val) > 0}
         )
 
-    @property
+    @cached_property
     def energyByMode(self):
-        if len(self._modeEnergy) == 0:
-            for scenarioName, data in self._runs.items():
-                try:
-                    self._modeEnergy[scenarioName] = data.modeEnergyPerYear.dataFrame
-                except HTTPError:
-                    continue
-        return pd.concat(
-            {key: val for key, val in self._modeEnergy.items() if len(val) > 0},
-            names=["scenario"] + data.modeEnergyPerYear.dataFrame.index.names,
+        modeEnergy = dict()
+        for scenarioName, data in self._iterRuns():
+            try:
+                modeEnergy[scenarioName] = data.modeEnergyPerYear.dataFrame
+            except HTTPError:
+                continue
+        return self._concatScenarios(
+            {key: val for key, val in modeEnergy.items() if len(val) > 0}
         )
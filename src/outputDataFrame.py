@@ -1,10 +1,18 @@
+import base64
 import hashlib
 import os
-from typing import Dict, Tuple, List, Union, Optional
+import tempfile
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property, lru_cache
+from typing import Callable, Dict, Tuple, List, Union, Optional
 from pandas.api.types import is_numeric_dtype
 import numpy as np
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 from src.input import (
     InputDirectory,
@@ -20,11 +28,173 @@ from src.transformations import (
     filterPersons,
     filterHouseholds,
     filterTrips,
+    PERSON_COLUMNS,
+    HOUSEHOLD_COLUMNS,
+    TRIP_COLUMNS,
     mergeLinkstatsWithNetwork,
     labelNetworkWithTaz,
     doInexus,
+    mapCategories,
 )
 
+# Part of every cache key. Bump this whenever a change to a load() or preprocess()
+# alters what gets written, so stale parquet files in .tmp are not read back
+CACHE_VERSION = "6"
+
+# Codec for the cached parquet files. Low zstd levels decompress nearly as fast as
+# lz4 while writing noticeably smaller files; "lz4" is still a fine choice on fast disks
+CACHE_COMPRESSION = "zstd"
+CACHE_COMPRESSION_LEVEL = 3
+# Rows converted to Arrow and written at a time, one row group each. Only one slice of
+# a frame is ever held as Arrow, rather than a second copy of the whole frame
+CACHE_ROW_GROUP_SIZE = 1 << 20
+
+# Groups ActivitySim trip modes into the aggregate modes that are reported
+TRIP_MODE_MAPPING = {
+    "DRIVEALONEPAY": "SOV",
+    "DRIVEALONEFREE": "SOV",
+    "SHARED2PAY": "HOV",
+    "SHARED2FREE": "HOV",
+    "WALK": "WALK",
+    "SHARED3PAY": "HOV",
+    "SHARED3FREE": "HOV",
+    "DRIVE_LOC": "DRIVE_TRANSIT",
+    "DRIVE_HVY": "DRIVE_TRANSIT",
+    "DRIVE_LRF": "DRIVE_TRANSIT",
+    "DRIVE_COM": "DRIVE_TRANSIT",
+    "WALK_LOC": "WALK_TRANSIT",
+    "WALK_HVY": "WALK_TRANSIT",
+    "WALK_LRF": "WALK_TRANSIT",
+    "WALK_COM": "WALK_TRANSIT",
+    "TAXI": "TNC",
+    "TNC_SINGLE": "TNC",
+    "TNC_SHARED": "TNC",
+}
+TRIP_MODE_CATEGORIES = pd.Index(sorted(set(TRIP_MODE_MAPPING.values())))
+
+# Event types that are pulled out of the raw events file together, in one pass
+EVENT_TYPES = ["PathTraversal", "PersonEntersVehicle", "ModeChoice"]
+
+# Frames that are already in memory, keyed by cache file, so that separate objects
+# standing for the same output share one copy. Values are weak references, so a
+# frame is dropped from here as soon as nothing else holds it. Because they are shared,
+# frames taken from a dataFrame property must never be modified in place; derive new
+# frames (e.g. with assign) instead
+_liveFrames = weakref.WeakValueDictionary()
+
+# One lock per cache file, taken while its frame is loaded or read and written
+_cacheLocks = dict()
+
+
+@lru_cache(maxsize=None)
+def cacheKey(*parts: str) -> str:
+    """
+    Generates the cache file name for a DataFrame from the strings that identify it.
+
+    Parameters:
+        *parts (str): Identifying strings, e.g. the input directory and class name.
+
+    Returns:
+        str: The generated hash.
+    """
+    # An 80 bit BLAKE2 digest in base32 gives 16 character names. base32 rather than
+    # base64 so that names can't collide on case-insensitive filesystems
+    # Parts are joined with a null byte so that e.g. ("ab", "c") and ("a", "bc") differ
+    digest = hashlib.blake2b(
+        "\x00".join((CACHE_VERSION,) + parts).encode(), digest_size=10
+    ).digest()
+    return base64.b32encode(digest).decode().lower()
+
+
+def writeParquet(df: pd.DataFrame, path: str):
+    """
+    Writes a DataFrame to a cache file with pyarrow, using the cache compression settings.
+
+    Parameters:
+        df (pd.DataFrame): The DataFrame to write.
+        path (str): The file to write to.
+    """
+    # Written under a temporary name and moved into place, so that an interrupted write
+    # never leaves a truncated file behind that looks like a valid cache entry. mkstemp
+    # makes the name unique per call, not just per process, as threads also write here
+    fd, tmpPath = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp"
+    )
+    os.close(fd)
+    # The schema comes from the whole frame, so that e.g. an object column that happens
+    # to be all null in the first slice isn't inferred as null typed
+    schema = pa.Schema.from_pandas(df)
+    try:
+        with pq.ParquetWriter(
+            tmpPath,
+            schema,
+            compression=CACHE_COMPRESSION,
+            compression_level=CACHE_COMPRESSION_LEVEL,
+            data_page_version="2.0",
+        ) as writer:
+            for start in range(0, len(df), CACHE_ROW_GROUP_SIZE):
+                chunk = df.iloc[start : start + CACHE_ROW_GROUP_SIZE]
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema))
+        os.replace(tmpPath, path)
+    finally:
+        if os.path.exists(tmpPath):
+            os.remove(tmpPath)
+
+
+def readParquet(path: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Reads a cache file written by writeParquet, optionally only some of its columns.
+
+    Parameters:
+        path (str): The file to read.
+        columns (list, optional): Columns to read. The index is always included.
+
+    Returns:
+        pd.DataFrame: The DataFrame read from the file.
+    """
+    # Memory mapping lets pyarrow decode straight from the OS page cache rather than
+    # through a read buffer. self_destruct frees each Arrow column as soon as it has
+    # been converted, so a large file isn't held in memory twice
+    table = pq.read_table(
+        path, columns=columns, use_pandas_metadata=True, memory_map=True
+    )
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+
+def latestIterations(runs: dict) -> dict:
+    """
+    Picks each year's output from its last iteration, in a single pass.
+
+    Parameters:
+        runs (dict): (year, iteration) to run output data.
+
+    Returns:
+        dict: Year to the run output data of that year's last iteration.
+    """
+    latest = dict()
+    for (yr, it), data in runs.items():
+        if yr not in latest or it > latest[yr][0]:
+            latest[yr] = (it, data)
+    return {yr: data for yr, (it, data) in latest.items()}
+
+
+def loadYears(runs: dict, fetch: Callable) -> Dict[int, pd.DataFrame]:
+    """
+    Fetches one DataFrame per year on a small thread pool. Reading the cached parquet
+    files and most pandas aggregations release the GIL, so the years overlap.
+
+    Parameters:
+        runs (dict): Year to the run output data to fetch from.
+        fetch (Callable): Takes a run's output data and returns its DataFrame.
+
+    Returns:
+        Dict[int, pd.DataFrame]: Year to fetched DataFrame, in the order of runs.
+    """
+    if not runs:
+        return dict()
+    with ThreadPoolExecutor(max_workers=min(8, len(runs))) as pool:
+        return dict(zip(runs, pool.map(fetch, runs.values())))
+
 
 class OutputDataFrame:
     """
@@ -52,12 +222,20 @@ class OutputDataFrame:
         self.outputDataDirectory = outputDataDirectory
         self.inputDirectory = inputDirectory
         self._dataFrame = None
-        self._diskLocation = os.path.join(
-            ".tmp",
-            self.hash() + ".parquet",
-        )
         self.indexedOn = None
 
+    @cached_property
+    def _diskLocation(self) -> str:
+        """
+        The file location for caching the DataFrame, only worked out when first needed.
+        Files are sharded into subdirectories by the first two characters of the hash
+        so that no single directory grows too large.
+        """
+        key = self.hash()
+        folder = os.path.join(".tmp", key[:2])
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, key[2:] + ".parquet")
+
     def hash(self):
         """
         Generates a hash based on the input and class name.
@@ -65,10 +243,21 @@ class OutputDataFrame:
         Returns:
             str: The generated hash.
         """
-        m = hashlib.md5()
-        for s in (self.inputDirectory.directoryPath, self.__class__.__name__):
-            m.update(s.encode())
-        return m.hexdigest()
+        return cacheKey(*self._inputKey(), self.__class__.__name__)
+
+    def _inputKey(self) -> Tuple[str, ...]:
+        """
+        Identifies the input for the cache key. For local inputs the latest modification
+        time of the directory's raw output files is included, so that rerunning a model
+        into the same folder invalidates the cache (best effort, see InputDirectory.mtime).
+
+        Returns:
+            Tuple[str, ...]: The input directory path, plus its files' mtime if local.
+        """
+        mtime = self.inputDirectory.mtime
+        if mtime is None:
+            return (self.inputDirectory.directoryPath,)
+        return self.inputDirectory.directoryPath, repr(mtime)
 
     @property
     def cached(self) -> bool:
@@ -86,8 +275,39 @@ class OutputDataFrame:
         """
         if self.cached:
             os.remove(self._diskLocation)
+        _liveFrames.pop(self._diskLocation, None)
         self._dataFrame = None
 
+    def _loadEventType(self, eventType: str) -> pd.DataFrame:
+        """
+        Returns the events of one type from the BEAM run's events file. The first request
+        collects every type in EVENT_TYPES in a single pass over the file, so the other
+        event frames are built without reading it again.
+
+        Parameters:
+            eventType (str): The event type to return, e.g. "PathTraversal".
+
+        Returns:
+            pd.DataFrame: The events of that type, indexed by event_id.
+        """
+        eventsFile = self.beamInputDirectory.eventsFile
+        if eventType not in eventsFile.eventTypes:
+            print(
+                "Downloading events for {0} from {1}".format(
+                    self.__class__.__name__, eventsFile.filePath
+                )
+            )
+            eventsFile.collectEvents(
+                [
+                    tab
+                    for tab in dict.fromkeys(EVENT_TYPES + [eventType])
+                    if tab not in eventsFile.eventTypes
+                ]
+            )
+        df = eventsFile.eventTypes[eventType]
+        df.index.name = "event_id"
+        return df
+
     def load(self):
         """
         Abstract method for loading data into a DataFrame.
@@ -100,12 +320,12 @@ class OutputDataFrame:
     def _write(self, obj):
         assert isinstance(obj, pd.DataFrame)
         try:
-            obj.to_parquet(self._diskLocation, engine="fastparquet")
+            writeParquet(obj, self._diskLocation)
         except Exception as e:
             print(e)
 
-    def _read(self):
-        return pd.read_parquet(self._diskLocation, engine="fastparquet")
+    def _read(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        return readParquet(self._diskLocation, columns)
 
     @property
     def dataFrame(self) -> pd.DataFrame:
@@ -115,6 +335,20 @@ class OutputDataFrame:
         Returns:
             pd.DataFrame: The loaded DataFrame.
         """
+        if self._dataFrame is None:
+            # Objects for the same cache file share a lock, so that threads (e.g. the
+            # years of loadYears reaching one skims file) wait for a single load and
+            # write rather than each running their own
+            with _cacheLocks.setdefault(self._diskLocation, threading.RLock()):
+                self._loadDataFrame()
+        return self._dataFrame
+
+    def _loadDataFrame(self):
+        """
+        Fills in the DataFrame from another live object, the cache file, or load().
+        """
+        if self._dataFrame is None:
+            self._dataFrame = _liveFrames.get(self._diskLocation)
         if self._dataFrame is None:
             if not self.cached:
                 # self.beamInputDirectory.eventsFile.filePath = "~/Downloads/1.events-maxtelework.csv.gz"
@@ -145,8 +379,27 @@ class OutputDataFrame:
                             self.__class__.__name__, self._diskLocation
                         )
                     )
-                    self._dataFrame.to_parquet(self._diskLocation, engine="fastparquet")
-        return self._dataFrame
+                    self._write(self._dataFrame)
+            if isinstance(self._dataFrame, pd.DataFrame):
+                _liveFrames[self._diskLocation] = self._dataFrame
+
+    def dataFrameColumns(self, columns: List[str]) -> pd.DataFrame:
+        """
+        Returns a subset of the DataFrame's columns. If the DataFrame isn't in memory
+        yet but is cached, only those columns are read from the parquet file.
+
+        Parameters:
+            columns (list): The columns to return. The index is always included.
+
+        Returns:
+            pd.DataFrame: The projected DataFrame.
+        """
+        if (self._dataFrame is None) and self.cached:
+            try:
+                return self._read(columns)
+            except Exception as e:
+                print(e)
+        return self.dataFrame[columns]
 
     @dataFrame.setter
     def dataFrame(self, df: pd.DataFrame):
@@ -193,9 +446,23 @@ class OutputDataFrame:
         Returns:
             pd.DataFrame: The modified DataFrame.
         """
-        self.dataFrame[toCol] = self.dataFrame.index.get_level_values(fromCol).map(
-            mapping
-        )
+        index = self.dataFrame.index
+        if isinstance(index, pd.MultiIndex):
+            # Map each distinct level value once and gather the result through the level's
+            # codes, rather than materializing and mapping the level for every row
+            level = index.names.index(fromCol)
+            codes = index.codes[level]
+            if (codes == -1).any():
+                # Missing values have no level to map, and the mapped level may not be
+                # able to hold NaN (e.g. ints), so these go through the plain map
+                values = index.get_level_values(level).map(mapping)
+            else:
+                values = index.levels[level].map(mapping).take(codes)
+        else:
+            values = index.map(mapping)
+        # The frame may be shared with other objects through _liveFrames, so the column
+        # goes on a new frame that only this object holds
+        self.dataFrame = self.dataFrame.assign(**{toCol: values})
         return self.dataFrame
 
     def unstackColumn(self, col, index):
@@ -265,23 +532,7 @@ class PathTraversalEvents(OutputDataFrame):
         Returns:
             pd.DataFrame: The loaded DataFrame.
         """
-
-        if "PathTraversal" not in self.beamInputDirectory.eventsFile.eventTypes:
-            print(
-                "Downloading events for {0} from {1}".format(
-                    self.__class__.__name__,
-                    self.beamInputDirectory.eventsFile.filePath,
-                )
-            )
-            self.beamInputDirectory.eventsFile.collectEvents(
-                ["PathTraversal", "PersonEntersVehicle", "ModeChoice"]
-            )
-        df = self.beamInputDirectory.eventsFile.eventTypes["PathTraversal"]
-        # else:
-        #     df = self.beamInputDirectory.eventsFile.file()
-        #     df = df.loc[df["type"] == "PathTraversal", :].dropna(axis=1, how="all")
-        df.index.name = "event_id"
-        return df
+        return self._loadEventType("PathTraversal")
 
 
 class PersonTrips(OutputDataFrame):
@@ -319,25 +570,58 @@ class PersonTrips(OutputDataFrame):
         ptExists = os.path.exists("{0}_{1}.parquet".format(loc, "PathTraversal"))
         return mcExists & ptExists
 
+    def clearCache(self):
+        """
+        Clears the cached tables.
+        """
+        loc = self._diskLocation.replace(".parquet", "")
+        for tab in self.__requiredTables:
+            fileLoc = "{0}_{1}.parquet".format(loc, tab)
+            if os.path.exists(fileLoc):
+                os.remove(fileLoc)
+        _liveFrames.pop(self._diskLocation, None)
+        self._dataFrame = None
+
     def _write(self, obj):
         assert isinstance(obj, dict)
         loc = self._diskLocation.replace(".parquet", "")
-        for grp, df in obj.items():
+
+        def write(grp, df):
             fileLoc = "{0}_{1}.parquet".format(loc, grp)
-            print("Saving {0} file to {1}".format(fileLoc, grp))
-            try:
-                df.to_parquet(fileLoc, engine="fastparquet")
-            except Exception as e:
-                print(e)
-                print("OH NO!!!")
+            print("Saving {0} file to {1}".format(grp, fileLoc))
+            writeParquet(df, fileLoc + ".partial")
+
+        # The tables go to separate files, so they can be encoded and written at once
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = {grp: pool.submit(write, grp, df) for grp, df in obj.items()}
+        failed = False
+        for grp, future in futures.items():
+            if future.exception() is not None:
+                print("Couldn't save {0} file: {1}".format(grp, future.exception()))
+                failed = True
+        # Only a complete set of tables is moved into place, ModeChoice and
+        # PathTraversal last since they are what marks the set as cached
+        for grp in sorted(
+            futures, key=lambda grp: grp in ("ModeChoice", "PathTraversal")
+        ):
+            fileLoc = "{0}_{1}.parquet".format(loc, grp)
+            if os.path.exists(fileLoc + ".partial"):
+                if failed:
+                    os.remove(fileLoc + ".partial")
+                else:
+                    os.replace(fileLoc + ".partial", fileLoc)
 
-    def _read(self):
-        out = dict()
+    def _read(self, columns: Optional[List[str]] = None):
         loc = self._diskLocation.replace(".parquet", "")
-        for tab in list(self.__requiredTables):
-            fileLoc = "{0}_{1}.parquet".format(loc, tab)
-            out[tab] = pd.read_parquet(fileLoc, engine="fastparquet")
-        return out
+        tables = list(self.__requiredTables)
+        # pyarrow releases the GIL while reading and decoding, so one table's disk
+        # reads overlap with another's conversion to pandas
+        with ThreadPoolExecutor(max_workers=len(tables)) as pool:
+            frames = pool.map(
+                lambda tab: readParquet("{0}_{1}.parquet".format(loc, tab), columns),
+                tables,
+            )
+            return dict(zip(tables, frames))
 
     def preprocess(self, df):
         """
@@ -379,16 +663,10 @@ class PersonTrips(OutputDataFrame):
 
     def chunk(self, personIdToChunk):
         unSplitData = self.dataFrame
+        # Build the lookup once rather than having Index.map convert the dict per table.
+        # As a categorical, the groupby below runs on integer codes
+        divisionByPerson = pd.Series(personIdToChunk, dtype="category")
         outputData = dict()
-        try:
-            print(
-                unSplitDf.index.get_level_values("IDMerged")
-                .astype(int)
-                .map(personIdToChunk)
-                .head(2)
-            )
-        except:
-            print("DSTSTS")
         for fileType in [
             "ModeChoice",
             "PathTraversal",
@@ -399,14 +677,12 @@ class PersonTrips(OutputDataFrame):
         ]:
             print("Breaking {0} file into chunks".format(fileType))
             unSplitDf = unSplitData[fileType]
-            unSplitDf["divisionId"] = (
-                unSplitDf.index.get_level_values("IDMerged")
-                .astype(int)
-                .map(personIdToChunk)
+            unSplitDf["divisionId"] = divisionByPerson.reindex(
+                unSplitDf.index.get_level_values("IDMerged").astype(int)
+            ).array
+            outputData[fileType] = dict(
+                tuple(unSplitDf.groupby("divisionId", sort=False, observed=True))
             )
-            outputData[fileType] = {
-                k: table for k, table in unSplitDf.groupby("divisionId")
-            }
         return outputData
 
 
@@ -442,15 +718,7 @@ class PersonEntersVehicleEvents(OutputDataFrame):
         Returns:
             pd.DataFrame: The loaded DataFrame.
         """
-        if "PersonEntersVehicle" in self.beamInputDirectory.eventsFile.eventTypes:
-            df = self.beamInputDirectory.eventsFile.eventTypes["PersonEntersVehicle"]
-        else:
-            df = self.beamInputDirectory.eventsFile.file()
-            df = df.loc[df["type"] == "PersonEntersVehicle", :].dropna(
-                axis=1, how="all"
-            )
-        df.index.name = "event_id"
-        return df
+        return self._loadEventType("PersonEntersVehicle")
 
 
 class ModeChoiceEvents(OutputDataFrame):
@@ -472,13 +740,7 @@ class ModeChoiceEvents(OutputDataFrame):
         self.indexedOn = "event_id"
 
     def load(self):
-        if "ModeChoice" in self.beamInputDirectory.eventsFile.eventTypes:
-            df = self.beamInputDirectory.eventsFile.eventTypes["ModeChoice"]
-        else:
-            df = self.beamInputDirectory.eventsFile.file()
-            df = df.loc[df["type"] == "ModeChoice", :].dropna(axis=1, how="all")
-        df.index.name = "event_id"
-        return df
+        return self._loadEventType("ModeChoice")
 
 
 class ModeVMT(OutputDataFrame):
@@ -513,8 +775,10 @@ class ModeVMT(OutputDataFrame):
         Returns:
             pd.DataFrame: The loaded DataFrame.
         """
-        df = self.pathTraversalEvents.dataFrame.groupby("mode_extended").agg(
-            {"vehicleMiles": "sum"}
+        df = (
+            self.pathTraversalEvents.dataFrameColumns(["mode_extended", "vehicleMiles"])
+            .groupby("mode_extended", observed=True)
+            .agg({"vehicleMiles": "sum"})
         )
         df.index.name = self.indexedOn
         return df
@@ -553,8 +817,12 @@ class ModeEnergy(OutputDataFrame):
         Returns:
             pd.DataFrame: The loaded DataFrame.
         """
-        df = self.pathTraversalEvents.dataFrame.groupby("mode_extended").agg(
-            {"totalEnergyInJoules": "sum"}
+        df = (
+            self.pathTraversalEvents.dataFrameColumns(
+                ["mode_extended", "totalEnergyInJoules"]
+            )
+            .groupby("mode_extended", observed=True)
+            .agg({"totalEnergyInJoules": "sum"})
         )
         df.index.name = self.indexedOn
         df.loc[df.index.astype(str).str.startswith("car"), :] *= 10
@@ -576,7 +844,7 @@ class LinkStatsFromPathTraversals(OutputDataFrame):
         pathTraversalEvents: PathTraversalEvents,
     ):
         """
-        Initializes a ModeVMT instance.
+        Initializes a LinkStatsFromPathTraversals instance.
 
         Parameters:
             outputDataDirectory (OutputDataDirectory): The output data directory.
@@ -588,12 +856,14 @@ class LinkStatsFromPathTraversals(OutputDataFrame):
 
     def load(self):
         """
-        Aggregates mode vehicle miles traveled data from the path traversal events data.
+        Reads only the link-level columns that getLinkStats needs from the path traversal events.
 
         Returns:
             pd.DataFrame: The loaded DataFrame.
         """
-        df = self.pathTraversalEvents.dataFrame
+        df = self.pathTraversalEvents.dataFrameColumns(
+            ["links", "linkTravelTime", "departureTime"]
+        )
         return df
 
     def preprocess(self, df: pd.DataFrame) -> pd.DataFrame:
@@ -611,9 +881,11 @@ class LabeledNetwork(OutputDataFrame):
         self.indexedOn = "linkId"
 
     def preprocess(self, df):
-        return labelNetworkWithTaz(
+        df = labelNetworkWithTaz(
             df, self.beamOutputData.geometry.gdf, self.beamOutputData.geometry.index
         )
+        # Link ids are joined against linkstats, see LabeledLinkStatsFile.preprocess
+        return df.set_axis(df.index.astype(np.int32))
 
     def load(self):
         return self.beamOutputData.networkFile.file()
@@ -655,7 +927,7 @@ class ProcessedPersonsFile(OutputDataFrame):
         return filterPersons(df)
 
     def load(self):
-        return self.activitySimOutputData.personsFile.file()
+        return self.activitySimOutputData.personsFile.read(PERSON_COLUMNS)
 
 
 class ProcessedHouseholdsFile(OutputDataFrame):
@@ -687,7 +959,7 @@ class ProcessedHouseholdsFile(OutputDataFrame):
         return filterHouseholds(df)
 
     def load(self):
-        return self.activitySimOutputData.personsFile.file()
+        return self.activitySimOutputData.householdsFile.read(HOUSEHOLD_COLUMNS)
 
 
 class ProcessedTripsFile(OutputDataFrame):
@@ -719,7 +991,7 @@ class ProcessedTripsFile(OutputDataFrame):
         return filterTrips(df)
 
     def load(self):
-        return self.activitySimOutputData.tripsFile.file()
+        return self.activitySimOutputData.tripsFile.read(TRIP_COLUMNS)
 
 
 class ProcessedSkimsFile(OutputDataFrame):
@@ -764,6 +1036,30 @@ class TAZBasedDataFrame(OutputDataFrame):
         super().__init__(outputDataDirectory, inputDirectory)
         self.geometry = geometry
         self.geoIndex = "TAZ"  # TODO: Generalize this
+        self._withGeometry = None
+        self._withGeometrySource = None
+
+    def withGeometry(self) -> pd.DataFrame:
+        """
+        Returns the DataFrame joined with the geometry attributes of each zone.
+
+        The join is cached for as long as the underlying DataFrame is unchanged, so
+        successive calls to process() with different aggregations only merge once.
+
+        Returns:
+            pd.DataFrame: The DataFrame with geometry columns, indexed as the original.
+        """
+        if self.geometry is None:
+            raise AttributeError("You need to define a geometry to do this")
+        df = self.dataFrame
+        if self._withGeometrySource is not df:
+            self._withGeometry = (
+                df.reset_index()
+                .merge(self.geometry.gdf, left_on=self.geoIndex, right_on="taz1454")
+                .set_index(self.indexedOn)
+            )
+            self._withGeometrySource = df
+        return self._withGeometry
 
     def process(
         self,
@@ -771,24 +1067,20 @@ class TAZBasedDataFrame(OutputDataFrame):
         aggregateBy: Optional[List[str]] = None,
         mapping: Optional[Dict[str, str]] = None,
     ) -> pd.DataFrame:
-        outputColumns = set((mapping or dict()).keys())
-        temp = self.dataFrame.copy()
+        mapping = dict(mapping or dict())
+        outputColumns = set(mapping.keys())
         additionalColumns = set()
         if ("area" in (normalize or dict()).values()) | (
             ("county" in (aggregateBy or [])) | ("areatype10" in (aggregateBy or []))
         ):
-            if self.geometry is None:
-                raise AttributeError("You need to define a geometry to do this")
-            temp = (
-                temp.reset_index()
-                .merge(self.geometry.gdf, left_on=self.geoIndex, right_on="taz1454")
-                .set_index(self.indexedOn)
-            )
+            temp = self.withGeometry()
+        else:
+            temp = self.dataFrame
         if "area" in (normalize or dict()).values():
             mapping["gacres"] = "sum"
             additionalColumns.add("gacres")
         if ("county" in (aggregateBy or [])) | ("areatype10" in (aggregateBy or [])):
-            grouper = list({"county", "areatype10"}.intersection(set(aggregateBy)))
+            grouper = [col for col in ("county", "areatype10") if col in aggregateBy]
             if self.indexedOn is not None:
                 if isinstance(self.indexedOn, list):
                     for io in self.indexedOn:
@@ -802,25 +1094,30 @@ class TAZBasedDataFrame(OutputDataFrame):
         else:
             grouper = None
         if grouper is not None:
-            temp = (
-                temp.reset_index()[
+            # groupby resolves index level names as well as columns, so only the needed
+            # columns are selected instead of resetting the index of the whole frame
+            needed = [
+                col
+                for col in dict.fromkeys(
                     list(outputColumns) + grouper + list(additionalColumns)
-                ]
-                .groupby(grouper)
-                .agg(mapping)
-            )
+                )
+                if col in temp.columns
+            ]
+            temp = temp[needed].groupby(grouper, observed=True).agg(mapping)
             print("done")
+        # Densities are added to the selected output rather than to temp, which may be
+        # the cached frame itself
+        densities = dict()
         for col, fn in (normalize or dict()).items():
             outputColumns.add("gacres")
             if fn == "area":
-                temp[col + "Density"] = temp[col].copy() / temp["gacres"]
-                outputColumns.add(col + "Density")
+                densities[col + "Density"] = temp[col] / temp["gacres"]
                 outputColumns.add(col)
             else:
                 raise NotImplementedError(
                     "Don't have aggregation {0} implemented yet".format(fn)
                 )
-        return temp[list(outputColumns)]
+        return temp[list(outputColumns)].assign(**densities)
 
 
 class LabeledLinkStatsFile(TAZBasedDataFrame):
@@ -858,6 +1155,15 @@ class LabeledLinkStatsFile(TAZBasedDataFrame):
         return None
 
     def preprocess(self, df):
+        # Give the join key the same plain int32 dtype as the labeled network's index,
+        # so the merge hashes machine integers rather than going through the nullable
+        # Int64 links of path traversals. Both branches return a new frame, leaving the
+        # source's cached frame untouched by the columns added during the merge
+        if "link" in df.columns:
+            df = df.astype({"link": np.int32})
+        else:
+            links = df.index.levels[df.index.names.index("link")]
+            df = df.set_axis(df.index.set_levels(links.astype(np.int32), level="link"))
         return mergeLinkstatsWithNetwork(df, self.labeledNetwork.dataFrame, self.geometry.index)
 
     def hash(self):
@@ -867,14 +1173,11 @@ class LabeledLinkStatsFile(TAZBasedDataFrame):
         Returns:
             str: The generated hash.
         """
-        m = hashlib.md5()
-        for s in (
-            self.inputDirectory.directoryPath,
+        return cacheKey(
+            *self._inputKey(),
             self.__class__.__name__,
             self.source.__class__.__name__,
-        ):
-            m.update(s.encode())
-        return m.hexdigest()
+        )
 
 
 class TAZTrafficVolumes(TAZBasedDataFrame):
@@ -926,12 +1229,14 @@ class MandatoryLocationsByTaz(TAZBasedDataFrame):
         self.personsFile = personsFile
 
     def load(self):
-        population = self.personsFile.dataFrame["TAZ"].value_counts().astype(int)
-        workplaces = self.personsFile.dataFrame["work_zone_id"].value_counts()
-        workplaces = workplaces.loc[workplaces.index > 0]
-        workplaces.index.set_names("TAZ", inplace=True)
-        return pd.concat({"population": population, "jobs": workplaces}, axis=1).fillna(
-            0
+        persons = self.personsFile.dataFrame[["TAZ", "work_zone_id"]]
+        population = persons.groupby("TAZ", sort=False).size()
+        workers = persons.loc[persons["work_zone_id"] > 0, "work_zone_id"]
+        workplaces = workers.groupby(workers, sort=False).size().rename_axis("TAZ")
+        return (
+            pd.DataFrame({"population": population, "jobs": workplaces})
+            .fillna(0)
+            .astype("int64")
         )
 
 
@@ -964,29 +1269,14 @@ class TripModeCount(TAZBasedDataFrame):
         self.indices = ["trip_mode"]
 
     def load(self):
-        mapping = {
-            "DRIVEALONEPAY": "SOV",
-            "DRIVEALONEFREE": "SOV",
-            "SHARED2PAY": "HOV",
-            "SHARED2FREE": "HOV",
-            "WALK": "WALK",
-            "SHARED3PAY": "HOV",
-            "SHARED3FREE": "HOV",
-            "DRIVE_LOC": "DRIVE_TRANSIT",
-            "DRIVE_HVY": "DRIVE_TRANSIT",
-            "DRIVE_LRF": "DRIVE_TRANSIT",
-            "DRIVE_COM": "DRIVE_TRANSIT",
-            "WALK_LOC": "WALK_TRANSIT",
-            "WALK_HVY": "WALK_TRANSIT",
-            "WALK_LRF": "WALK_TRANSIT",
-            "WALK_COM": "WALK_TRANSIT",
-            "TAXI": "TNC",
-            "TNC_SINGLE": "TNC",
-            "TNC_SHARED": "TNC",
-        }
+        df = self.tripsFile.dataFrame[self.indices]
+        tripMode = mapCategories(
+            df["trip_mode"], TRIP_MODE_MAPPING, TRIP_MODE_CATEGORIES
+        )
         return (
-            self.tripsFile.dataFrame.replace({"trip_mode": mapping})
+            df.assign(trip_mode=tripMode)
             .value_counts(self.indices, normalize=False)
+            .loc[lambda counts: counts > 0]
             .to_frame("count")
         )
 
@@ -1020,38 +1310,19 @@ class TripPMT(OutputDataFrame):
         self.indices = ["trip_mode"]
 
     def load(self):
-        mapping = {
-            "DRIVEALONEPAY": "SOV",
-            "DRIVEALONEFREE": "SOV",
-            "SHARED2PAY": "HOV",
-            "SHARED2FREE": "HOV",
-            "WALK": "WALK",
-            "SHARED3PAY": "HOV",
-            "SHARED3FREE": "HOV",
-            "DRIVE_LOC": "DRIVE_TRANSIT",
-            "DRIVE_HVY": "DRIVE_TRANSIT",
-            "DRIVE_LRF": "DRIVE_TRANSIT",
-            "DRIVE_COM": "DRIVE_TRANSIT",
-            "WALK_LOC": "WALK_TRANSIT",
-            "WALK_HVY": "WALK_TRANSIT",
-            "WALK_LRF": "WALK_TRANSIT",
-            "WALK_COM": "WALK_TRANSIT",
-            "TAXI": "TNC",
-            "TNC_SINGLE": "TNC",
-            "TNC_SHARED": "TNC",
-        }
-        self.tripsFile.dataFrame["distanceInMiles"] = (
-            self.skimsFile.dataFrame["DistanceMiles"]
-            .reindex(
-                pd.MultiIndex.from_frame(
-                    self.tripsFile.dataFrame[["origin", "destination"]]
-                ).values
-            )
-            .values
+        columns = list(dict.fromkeys(self.indices + ["origin", "destination"]))
+        df = self.tripsFile.dataFrame[columns].merge(
+            self.skimsFile.dataFrame["DistanceMiles"].rename("distanceInMiles"),
+            left_on=["origin", "destination"],
+            right_index=True,
+            how="left",
+        )
+        tripMode = mapCategories(
+            df["trip_mode"], TRIP_MODE_MAPPING, TRIP_MODE_CATEGORIES
         )
         return (
-            self.tripsFile.dataFrame.replace({"trip_mode": mapping})
-            .groupby(self.indices)
+            df.assign(trip_mode=tripMode)
+            .groupby(self.indices, observed=True)
             .agg({"distanceInMiles": "sum"})
         )
 
@@ -1072,22 +1343,16 @@ class MeanDistanceToWork(OutputDataFrame):
     def load(self):
         persons = self.personsFile.dataFrame.loc[
             self.personsFile.dataFrame.work_zone_id > 0, ["work_zone_id", "TAZ"]
-        ]
-        persons["distanceInMiles"] = (
-            self.skimsFile.dataFrame["DistanceMiles"]
-            .reindex(
-                pd.MultiIndex.from_frame(
-                    persons.rename(
-                        columns={"TAZ": "origin", "work_zone_id": "destination"}
-                    )
-                ).values
-            )
-            .values
+        ].merge(
+            self.skimsFile.dataFrame["DistanceMiles"].rename("distanceInMiles"),
+            left_on=["TAZ", "work_zone_id"],
+            right_index=True,
+            how="left",
         )
-        byTaz = persons.groupby(self.indices).agg(
-            {"distanceInMiles": ["sum", "length"]}
+        byTaz = persons.groupby(self.indices, sort=False).agg(
+            {"distanceInMiles": ["sum", "size"]}
         )["distanceInMiles"]
-        byTaz["meanDistance"] = byTaz["sum"] / byTaz["length"]
+        byTaz["meanDistance"] = byTaz["sum"] / byTaz["size"]
         return byTaz["meanDistance"].to_frame()
 
 
@@ -1226,10 +1491,14 @@ class MandatoryLocationByTazByYear(TAZBasedDataFrame):
         Returns:
             pd.DataFrame: The DataFrame containing the loaded data.
         """
+        runs = dict()
         for (yr, it), data in self.pilatesInputDict.items():
             if yr not in self.__yearToDataFrame:
-                self.__yearToDataFrame[yr] = data.mandatoryLocationsByTaz.dataFrame
-        return pd.concat(self.__yearToDataFrame, names=["Year", "TAZ"])
+                runs.setdefault(yr, data)
+        self.__yearToDataFrame.update(
+            loadYears(runs, lambda data: data.mandatoryLocationsByTaz.dataFrame)
+        )
+        return pd.concat(self.__yearToDataFrame, names=["Year", "TAZ"], copy=False)
 
 
 class TripPMTByYear(OutputDataFrame):
@@ -1241,23 +1510,17 @@ class TripPMTByYear(OutputDataFrame):
     ):
         super().__init__(outputDataDirectory, pilatesRunInputDirectory)
         self.pilatesInputDict = pilatesInputDict
-        self.__lastIterationPerYear = dict()
         self.__yearToDataFrame = dict()
 
     def load(self):
-        for (yr, it), data in self.pilatesInputDict.items():
-            if yr in self.__lastIterationPerYear:
-                if it <= self.__lastIterationPerYear[yr]:
-                    continue
-            else:
-                self.__lastIterationPerYear[yr] = it
-        for (yr, it), data in self.pilatesInputDict.items():
-            if self.__lastIterationPerYear[yr] == it:
-                self.__yearToDataFrame[yr] = data.tripPMT.dataFrame
-        if any(self.__yearToDataFrame):
-            return pd.concat(self.__yearToDataFrame, names=["year", "mode"])
+        runs = latestIterations(self.pilatesInputDict)
+        self.__yearToDataFrame.update(
+            loadYears(runs, lambda data: data.tripPMT.dataFrame)
+        )
+        if self.__yearToDataFrame:
+            return pd.concat(self.__yearToDataFrame, names=["year", "mode"], copy=False)
         else:
-            return pd.DataFrame
+            return pd.DataFrame()
 
 
 class TripPMTByCountyByYear(OutputDataFrame):
@@ -1269,25 +1532,24 @@ class TripPMTByCountyByYear(OutputDataFrame):
     ):
         super().__init__(outputDataDirectory, pilatesRunInputDirectory)
         self.pilatesInputDict = pilatesInputDict
-        self.__lastIterationPerYear = dict()
         self.__yearToDataFrame = dict()
 
     def load(self):
-        for (yr, it), data in self.pilatesInputDict.items():
-            if yr in self.__lastIterationPerYear:
-                if it <= self.__lastIterationPerYear[yr]:
-                    continue
-            else:
-                self.__lastIterationPerYear[yr] = it
-        for (yr, it), data in self.pilatesInputDict.items():
-            if self.__lastIterationPerYear[yr] == it:
-                self.__yearToDataFrame[yr] = data.tripPMTByOrigin.process(
+        runs = latestIterations(self.pilatesInputDict)
+        self.__yearToDataFrame.update(
+            loadYears(
+                runs,
+                lambda data: data.tripPMTByOrigin.process(
                     normalize=dict(), aggregateBy=["county"], mapping={"count": "sum"}
-                )
-        if any(self.__yearToDataFrame):
-            return pd.concat(self.__yearToDataFrame, names=["year", "county", "mode"])
+                ),
+            )
+        )
+        if self.__yearToDataFrame:
+            return pd.concat(
+                self.__yearToDataFrame, names=["year", "county", "mode"], copy=False
+            )
         else:
-            return pd.DataFrame
+            return pd.DataFrame()
 
 
 class TripModeCountByYear(OutputDataFrame):
@@ -1314,7 +1576,6 @@ class TripModeCountByYear(OutputDataFrame):
     ):
         super().__init__(outputDataDirectory, pilatesRunInputDirectory)
         self.pilatesInputDict = pilatesInputDict
-        self.__lastIterationPerYear = dict()
         self.__yearToDataFrame = dict()
 
     def load(self):
@@ -1324,19 +1585,14 @@ class TripModeCountByYear(OutputDataFrame):
         Returns:
             pd.DataFrame: The DataFrame containing the loaded data.
         """
-        for (yr, it), data in self.pilatesInputDict.items():
-            if yr in self.__lastIterationPerYear:
-                if it <= self.__lastIterationPerYear[yr]:
-                    continue
-            else:
-                self.__lastIterationPerYear[yr] = it
-        for (yr, it), data in self.pilatesInputDict.items():
-            if self.__lastIterationPerYear[yr] == it:
-                self.__yearToDataFrame[yr] = data.tripModeCount.dataFrame
-        if any(self.__yearToDataFrame):
-            return pd.concat(self.__yearToDataFrame, names=["year", "mode"])
+        runs = latestIterations(self.pilatesInputDict)
+        self.__yearToDataFrame.update(
+            loadYears(runs, lambda data: data.tripModeCount.dataFrame)
+        )
+        if self.__yearToDataFrame:
+            return pd.concat(self.__yearToDataFrame, names=["year", "mode"], copy=False)
         else:
-            return pd.DataFrame
+            return pd.DataFrame()
 
 
 class TripModeCountByCountyByYear(OutputDataFrame):
@@ -1363,7 +1619,6 @@ class TripModeCountByCountyByYear(OutputDataFrame):
     ):
         super().__init__(outputDataDirectory, pilatesRunInputDirectory)
         self.pilatesInputDict = pilatesInputDict
-        self.__lastIterationPerYear = dict()
         self.__yearToDataFrame = dict()
 
     def load(self):
@@ -1373,21 +1628,21 @@ class TripModeCountByCountyByYear(OutputDataFrame):
         Returns:
             pd.DataFrame: The DataFrame containing the loaded data.
         """
-        for (yr, it), data in self.pilatesInputDict.items():
-            if yr in self.__lastIterationPerYear:
-                if it <= self.__lastIterationPerYear[yr]:
-                    continue
-            else:
-                self.__lastIterationPerYear[yr] = it
-        for (yr, it), data in self.pilatesInputDict.items():
-            if self.__lastIterationPerYear[yr] == it:
-                self.__yearToDataFrame[yr] = data.tripModeCountByOrigin.process(
+        runs = latestIterations(self.pilatesInputDict)
+        self.__yearToDataFrame.update(
+            loadYears(
+                runs,
+                lambda data: data.tripModeCountByOrigin.process(
                     normalize=dict(), aggregateBy=["county"], mapping={"count": "sum"}
-                )
-        if any(self.__yearToDataFrame):
-            return pd.concat(self.__yearToDataFrame, names=["year", "county", "mode"])
+                ),
+            )
+        )
+        if self.__yearToDataFrame:
+            return pd.concat(
+                self.__yearToDataFrame, names=["year", "county", "mode"], copy=False
+            )
         else:
-            return pd.DataFrame
+            return pd.DataFrame()
 
 
 class ModeVMTByYear(OutputDataFrame):
@@ -1445,8 +1700,8 @@ class ModeVMTByYear(OutputDataFrame):
                     )
                     print(e)
                     x -= 1
-        if any(self.__yearToDataFrame):
-            return pd.concat(self.__yearToDataFrame, names=["year", "mode"])
+        if self.__yearToDataFrame:
+            return pd.concat(self.__yearToDataFrame, names=["year", "mode"], copy=False)
         else:
             return pd.DataFrame()
 
@@ -1506,8 +1761,8 @@ class ModeEnergyByYear(OutputDataFrame):
                     )
                     print(e)
                     x -= 1
-        if any(self.__yearToDataFrame):
-            return pd.concat(self.__yearToDataFrame, names=["year", "mode"])
+        if self.__yearToDataFrame:
+            return pd.concat(self.__yearToDataFrame, names=["year", "mode"], copy=False)
         else:
             return pd.DataFrame()
 
@@ -1545,9 +1800,9 @@ class CongestionInfoByYear(OutputDataFrame):
                     data = self.pilatesInputDict[(yr, x)]
                     tazIndex = data.geometry.index
                     df = data.tazTrafficVolumes.dataFrame
-                    df["mph"] = df["VMT"] / df["VHT"]
-                    df["congestedHours"] = df["mph"] < 2.0
-                    df = df.groupby([tazIndex, "attributeOrigType"]).agg(
+                    # assign rather than adding columns to the shared traffic volumes
+                    df = df.assign(congestedHours=(df["VMT"] / df["VHT"]) < 2.0)
+                    df = df.groupby([tazIndex, "attributeOrigType"], observed=True).agg(
                         {"VMT": "sum", "VHT": "sum", "congestedHours": "sum"}
                     )
                     df["mph"] = df["VMT"] / df["VHT"]
@@ -1563,7 +1818,9 @@ class CongestionInfoByYear(OutputDataFrame):
                     )
                     print(e)
                     x -= 1
-        if any(self.__yearToDataFrame):
-            return pd.concat(self.__yearToDataFrame, names=["year", "roadType"])
+        if self.__yearToDataFrame:
+            return pd.concat(
+                self.__yearToDataFrame, names=["year", "roadType"], copy=False
+            )
         else:
             return pd.DataFrame()
@@ -1,3 +1,5 @@
+from typing import Optional
+
 import pandas as pd
 import numpy as np
 import geopandas as gpd
@@ -32,13 +34,14 @@ def getLinkStats(PTs: pd.DataFrame):
     linksAndTravelTimes["cumulativeTravelTime"] = linksAndTravelTimes.groupby(
         level=0
     ).agg({"linkTravelTime": np.cumsum})
+    # Hours run a little past 24 at most, so int8 holds them in an eighth of the space
     linksAndTravelTimes["hour"] = np.floor(
         (
             linksAndTravelTimes["cumulativeTravelTime"]
             + linksAndTravelTimes["departureTime"]
         )
         / 3600.0
-    )
+    ).astype("int8")
     linksAndTravelTimes["volume"] = 1.0
     grouped = linksAndTravelTimes.groupby(["links", "hour"]).agg(
         {"linkTravelTime": np.sum, "volume": np.sum}
@@ -66,12 +69,13 @@ def fixPathTraversals(PTs: pd.DataFrame):
     PTs["isCAV"] = PTs["vehicleType"].str.contains("L5")
     PTs.loc[PTs["isRH"], "mode_extended"] += "_RideHail"
     PTs.loc[PTs["isCAV"], "mode_extended"] += "_CAV"
-    PTs["occupancy"] = PTs["numPassengers"]
+    PTs["occupancy"] = PTs.pop("numPassengers")
     PTs.loc[PTs["mode_extended"] == "car", "occupancy"] += 1
     PTs.loc[PTs["mode_extended"] == "walk", "occupancy"] = 1
     PTs.loc[PTs["mode_extended"] == "bike", "occupancy"] = 1
-    PTs["vehicleMiles"] = PTs["length"] / 1609.34
-    PTs["passengerMiles"] = (PTs["length"] * PTs["occupancy"]) / 1609.34
+    length = PTs.pop("length")
+    PTs["vehicleMiles"] = length / 1609.34
+    PTs["passengerMiles"] = (length * PTs["occupancy"]) / 1609.34
     PTs["totalEnergyInJoules"] = PTs["primaryFuel"] + PTs["secondaryFuel"]
     PTs["gallonsGasoline"] = 0.0
     PTs.loc[PTs["primaryFuelType"] == "gasoline", "gallonsGasoline"] += (
@@ -80,79 +84,114 @@ def fixPathTraversals(PTs: pd.DataFrame):
     PTs.loc[PTs["secondaryFuelType"] == "gasoline", "gallonsGasoline"] += (
         PTs.loc[PTs["secondaryFuelType"] == "gasoline", "secondaryFuel"] * 8.3141841e-9
     )
-    PTs.drop(
-        columns=[
-            "numPassengers",
-            "length",
-            "type",
-            "primaryFuelLevel",
-            "secondaryFuelLevel",
-            "fromStopIndex",
-            "toStopIndex",
-            "capacity",
-            "seatingCapacity",
-            "toStopIndex",
-        ],
-        inplace=True,
+    # Deleting columns splits blocks without copying them, unlike drop(), so the
+    # only full copy of the frame is the one made by convert_dtypes
+    for col in [
+        "type",
+        "primaryFuelLevel",
+        "secondaryFuelLevel",
+        "fromStopIndex",
+        "toStopIndex",
+        "capacity",
+        "seatingCapacity",
+    ]:
+        del PTs[col]
+    PTs = PTs.convert_dtypes()
+    # A handful of modes across millions of rows, so group on category codes
+    PTs["mode_extended"] = PTs["mode_extended"].astype("category")
+    return PTs
+
+
+def mapCategories(
+    values: pd.Series, mapping: dict, categories: Optional[pd.Index] = None
+) -> pd.Series:
+    """
+    Relabels a column through a (possibly many-to-one) mapping, looking up each
+    distinct value once rather than once per row. Values that are missing from the
+    mapping keep their own label.
+
+    Parameters:
+        values (pd.Series): The column to relabel.
+        mapping (dict): Old label to new label.
+        categories (pd.Index, optional): Categories to start from, usually the
+            values of the mapping. Labels outside of them are merged in.
+
+    Returns:
+        pd.Series: A categorical column with the new labels.
+    """
+    codes, uniques = pd.factorize(values)
+    mapped = pd.Index([mapping.get(value, value) for value in uniques])
+    if categories is None:
+        categories = mapped.unique()
+    else:
+        categories = categories.union(mapped.unique(), sort=None)
+    # The trailing -1 sends missing values (code -1) to a missing category code
+    newCodes = np.append(categories.get_indexer(mapped), -1)
+    return pd.Series(
+        pd.Categorical.from_codes(newCodes[codes], categories),
+        index=values.index,
+        name=values.name,
     )
-    return PTs.convert_dtypes()
+
+
+# Columns of the ActivitySim persons file that are kept for analysis
+PERSON_COLUMNS = [
+    "earning",
+    "worker",
+    "student",
+    "household_id",
+    "school_zone_id",
+    "age",
+    "work_zone_id",
+    "TAZ",
+    "home_x",
+    "home_y",
+]
 
 
 def filterPersons(persons: pd.DataFrame):
-    return persons.loc[
-        :,
-        [
-            "earning",
-            "worker",
-            "student",
-            "household_id",
-            "school_zone_id",
-            "age",
-            "work_zone_id",
-            "TAZ",
-            "home_x",
-            "home_y",
-        ],
-    ].copy()
+    return persons.loc[:, PERSON_COLUMNS].copy()
+
+
+# Columns of the ActivitySim households file that are kept for analysis
+HOUSEHOLD_COLUMNS = [
+    "recent_mover",
+    "num_workers",
+    "sf_detached",
+    "tenure",
+    "race_of_head",
+    "income",
+    "block_id",
+    "cars",
+    "hhsize",
+    "TAZ",
+    "num_drivers",
+    "num_children",
+]
 
 
 def filterHouseholds(households: pd.DataFrame):
-    return households.loc[
-        :,
-        [
-            "recent_mover",
-            "num_workers",
-            "sf_detached",
-            "tenure",
-            "race_of_head",
-            "income",
-            "block_id",
-            "cars",
-            "hhsize",
-            "TAZ",
-            "num_drivers",
-            "num_children",
-        ],
-    ].copy()
+    return households.loc[:, HOUSEHOLD_COLUMNS].copy()
+
+
+# Columns of the ActivitySim trips file that are kept for analysis
+TRIP_COLUMNS = [
+    "person_id",
+    "household_id",
+    "tour_id",
+    "primary_purpose",
+    "purpose",
+    "destination",
+    "origin",
+    "destination_logsum",
+    "depart",
+    "trip_mode",
+    "mode_choice_logsum",
+]
 
 
 def filterTrips(trips: pd.DataFrame):
-    return trips.loc[
-        :,
-        [
-            "person_id",
-            "household_id",
-            "tour_id",
-            "primary_purpose",
-            "purpose",
-            "destination",
-            "origin",
-            "destination_logsum",
-            "depart",
-            "trip_mode",
-            "mode_choice_logsum",
-        ],
-    ].copy()
+    return trips.loc[:, TRIP_COLUMNS].copy()
 
 
 def doInexus(dfs: dict):
@@ -735,21 +774,76 @@ def mergeWithTripsAndAggregate(events, trips, utilities, persons):
 
     eventsByTrip = events.groupby("tripId").agg(aggfunc)
 
+    # Trips and persons are unique on their index, so validate the join
+    # cardinality rather than risk a silent many-to-many blowup
     asimData = pd.merge(
-        pd.merge(utilities, trips[t_cols], left_on="trip_id", right_index=True),
+        pd.merge(
+            utilities,
+            trips[t_cols],
+            left_on="trip_id",
+            right_index=True,
+            how="inner",
+            validate="many_to_one",
+        ),
         persons[p_cols],
         left_on="person_id",
         right_index=True,
+        how="inner",
+        validate="many_to_one",
     )
 
-    final = pd.merge(
-        eventsByTrip.reset_index(),
-        asimData,
-        left_on="tripId",
-        right_on="trip_id",
-        how="outer",
+    # groupby already returns the events sorted by trip, so sort the ActivitySim
+    # side too and join on the indexes, which merges sorted keys in one pass
+    # instead of hashing them
+    eventsByTrip = eventsByTrip.reset_index().set_index(
+        eventsByTrip.index.astype(np.int64)
     )
-    return final
+    asimData = asimData.set_index("trip_id", drop=False).sort_index(kind="stable")
+    final = eventsByTrip.join(asimData, how="outer", validate="one_to_many")
+    return final.reset_index(drop=True)
+
+
+def combineChunk(pt, mc, te, pc, pe, rp, trips, utilities, persons):
+    """
+    Matches one chunk of BEAM events to their ActivitySim trips and aggregates them.
+
+    This is a module-level function so that joblib workers can unpickle it by
+    reference. Event types with no rows in the chunk are passed as None.
+
+    Parameters:
+        pt, te, pc, pe, rp (pd.DataFrame): PathTraversal, TeleportationEvent,
+            PersonCost, ParkingEvent and Replanning events for the chunk.
+        mc (pd.DataFrame): ModeChoice events for the chunk.
+        trips, utilities, persons (pd.DataFrame): ActivitySim outputs for the chunk.
+
+    Returns:
+        pd.DataFrame: One row per trip, combining BEAM and ActivitySim data.
+    """
+    eventsToCombine = []
+    if pt is not None:
+        eventsToCombine.append(
+            assignTripIdToEvents(
+                pt,
+                mc,
+                {
+                    "mode_choice_actual_BEAM": "mode_choice_actual_BEAM",
+                    "mode_choice_planned_BEAM": "mode_choice_planned_BEAM",
+                    "distance_mode_choice": "distance_mode_choice",
+                },
+            )
+        )
+    if te is not None:
+        tes = assignTripIdToEvents(
+            te, mc, {"distance_mode_choice": "distance_travelling"}
+        )
+        tes["distance_privateCar"] = tes["distance_travelling"].copy()
+        tes["distance_mode_choice"] = tes["distance_travelling"].copy()
+        eventsToCombine.append(tes)
+    for events in (pc, pe, rp):
+        if events is not None:
+            eventsToCombine.append(assignTripIdToEvents(events, mc))
+    allEvents = pd.concat(eventsToCombine, axis=0)
+    return mergeWithTripsAndAggregate(allEvents, trips, utilities, persons)
 
 
 def labelNetworkWithTaz(network: pd.DataFrame, TAZ: gpd.GeoDataFrame, taz_column: str):